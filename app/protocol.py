@@ -1,25 +1,50 @@
-import re
-import json
 from pydantic import BaseModel
 from typing import Any, Optional, Self
 from abc import ABC, abstractmethod
 
-_REGEXP_FLAGS = re.IGNORECASE | re.MULTILINE | re.DOTALL
-
-THOUGHTS_EXPR = re.compile(r"<thoughts>(.*?)</thoughts>", _REGEXP_FLAGS)
-TOOL_EXPR = re.compile(r"<tool>(.*?)</tool>", _REGEXP_FLAGS)
-ARGUMENTS_EXPR = re.compile(r"<tool_args>(.*?)</tool_args>", _REGEXP_FLAGS)
-RESPONSE_EXPR = re.compile(r"<response>(.*?)</response>", _REGEXP_FLAGS)
+from . import serialization
+
+MESSAGE_TAGS = ("thoughts", "tool", "tool_args", "response")
+
+_ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+
+def scan_tag_blocks(text: str) -> dict[str, str]:
+    """Single-pass, case-insensitive extraction of the first body of each message tag."""
+    lowered = text.lower()
+    if len(lowered) != len(text):
+        # Some non-ASCII characters change length when lowered, keep offsets aligned
+        lowered = text.translate(_ASCII_LOWER)
+    if "\u017f" in lowered:
+        # Long s matches "s" case-insensitively, like it did for the regex
+        lowered = lowered.replace("\u017f", "s")
+
+    blocks: dict[str, str] = {}
+    idx = lowered.find("<")
+    while idx != -1 and len(blocks) < len(MESSAGE_TAGS):
+        for tag in MESSAGE_TAGS:
+            if lowered.startswith(tag, idx + 1) and lowered.startswith(
+                ">", idx + 1 + len(tag)
+            ):
+                start = idx + len(tag) + 2
+                end = lowered.find(f"</{tag}>", start)
+                if end != -1:
+                    blocks.setdefault(tag, text[start:end])
+                # Continue right after the opening tag, other tags may be nested in it
+                idx = start - 1
+                break
+        idx = lowered.find("<", idx + 1)
+    return blocks
 
 
 class StructuredMessage(BaseModel):
     thoughts: Optional[str]
     tool: Optional[str]
-    tool_args: list[Any]
+    tool_args: list[Any] | dict[str, Any]
     response: Optional[str]
 
     def is_valid(self) -> bool:
-        return (self.thoughts and self.tool) or (self.thoughts and self.response)
+        return bool(self.thoughts) and bool(self.tool or self.response)
 
 
 class BaseConversationProtocol(ABC):
@@ -35,6 +60,10 @@ class BaseConversationProtocol(ABC):
     def serialize(self, message: StructuredMessage, new_line: bool = False) -> str:
         pass
 
+    @classmethod
+    def clean_response(cls, text: str) -> str:
+        return text
+
 
 class XMLConversationProtocol(BaseConversationProtocol):
     SCHEMA_EXAMPLE = """<thoughts>Your reasoning should happen here</thoughts>
@@ -44,44 +73,43 @@ class XMLConversationProtocol(BaseConversationProtocol):
 
     @classmethod
     def parse(cls, text: str) -> StructuredMessage:
-        if match := THOUGHTS_EXPR.search(text):
-            thoughts = match.group(1).strip()
-        else:
-            thoughts = None
+        blocks = scan_tag_blocks(text)
 
-        if match := TOOL_EXPR.search(text):
-            tool = match.group(1).strip()
-        else:
-            tool = None
+        thoughts = blocks["thoughts"].strip() if "thoughts" in blocks else None
+        tool = blocks["tool"].strip() if "tool" in blocks else None
 
-        if match := ARGUMENTS_EXPR.search(text):
+        # Arguments only matter when a tool is called, skip decoding otherwise
+        if tool and "tool_args" in blocks:
             try:
-                tool_args = json.loads(match.group(1).strip())
-            except json.JSONDecodeError:
+                tool_args = serialization.loads(blocks["tool_args"].strip())
+            except serialization.JSONDecodeError:
+                tool_args = []
+            if not isinstance(tool_args, (list, dict)):
+                # Positional or keyword arguments only, e.g. not a bare string
                 tool_args = []
         else:
             tool_args = []
 
-        if match := RESPONSE_EXPR.search(text):
-            response = match.group(1).strip()
-        else:
-            response = None
+        response = blocks["response"].strip() if "response" in blocks else None
 
         if not response:
             response = thoughts
 
-        return StructuredMessage(
+        # Fields are already str/None and decoded JSON, skip pydantic validation
+        return StructuredMessage.model_construct(
             thoughts=thoughts, tool=tool, tool_args=tool_args, response=response
         )
 
     @classmethod
     def serialize(cls, message: StructuredMessage, new_line: bool = False) -> str:
-        return "<thoughts>{}</thoughts>{nl}<tool>{}</tool>{nl}<tool_args>{}</tool_args>{nl}<response>{}</response>".format(
-            message.thoughts,
-            message.tool.lower(),
-            json.dumps(message.tool_args),
-            message.response,
-            nl="\n" if new_line else "",
+        nl = "\n" if new_line else ""
+        tool = (message.tool or "").lower()
+        tool_args = serialization.dumps(message.tool_args)
+        return (
+            f"<thoughts>{message.thoughts}</thoughts>{nl}"
+            f"<tool>{tool}</tool>{nl}"
+            f"<tool_args>{tool_args}</tool_args>{nl}"
+            f"<response>{message.response}</response>"
         )
 
 
@@ -93,9 +121,17 @@ class JSONConversationProtocol(BaseConversationProtocol):
   "response": "null if using a tool, otherwise your final response"
 }"""
 
+    @classmethod
+    def clean_response(cls, text: str) -> str:
+        # Drop anything around the outermost object, e.g. ```json fences
+        start, end = text.find("{"), text.rfind("}")
+        if start != -1 and end > start:
+            text = text[start : end + 1]
+        return text
+
     @classmethod
     def parse(cls, text: str) -> StructuredMessage:
-        data: dict[str, Any] = json.loads(text)
+        data: dict[str, Any] = serialization.loads(text)
         return StructuredMessage(
             thoughts=data.get("thoughts"),
             tool=data.get("tool"),
@@ -105,13 +141,12 @@ class JSONConversationProtocol(BaseConversationProtocol):
 
     @classmethod
     def serialize(cls, message: StructuredMessage, new_line: bool = False) -> str:
-        return json.dumps(
+        return serialization.dumps(
             {
                 "thoughts": message.thoughts,
                 "tool": message.tool,
                 "tool_args": message.tool_args,
                 "response": message.response,
             },
-            indent=2 if new_line else None,
-            ensure_ascii=False,
+            indent=new_line,
         )
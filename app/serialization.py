@@ -0,0 +1,34 @@
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSONDecodeError = json.JSONDecodeError
+
+
+def dumps(obj: Any, indent: bool = False) -> str:
+    """Serialize to a JSON string, non-ASCII characters are kept as is.
+    :param indent: Pretty-print with two spaces of indentation
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0).decode()
+    if indent:
+        return json.dumps(obj, indent=2, ensure_ascii=False)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    """Serialize to compact UTF-8 encoded JSON, e.g. for HTTP request bodies."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def loads(data: str | bytes) -> Any:
+    """Deserialize a JSON document, raises JSONDecodeError on invalid input."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
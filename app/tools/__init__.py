@@ -1,16 +1,28 @@
-import json
 import datetime
 import requests
 import os
+import shutil
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from functools import cached_property
+from requests.adapters import HTTPAdapter
 from typing import Callable, Any, Optional
 
 import wikipedia
 from duckduckgo_search import DDGS
 
+from ..serialization import dumps as json_dumps
 from .everything import search_files as everything_search_files
 
+_MAX_BULK_WORKERS = 32
+_DOWNLOAD_CHUNK_SIZE = 1 << 20
+_LISTING_ENTRIES_PER_PATH = 64
+
+_session = requests.Session()
+for _prefix in ("http://", "https://"):
+    _session.mount(_prefix, HTTPAdapter(pool_maxsize=_MAX_BULK_WORKERS))
+
 
 @dataclass(frozen=True)
 class LLMTool:
@@ -22,18 +34,30 @@ class LLMTool:
     def __repr__(self) -> str:
         return f"{self.name} - {self.description}"
 
-    def get_schema(self) -> dict[str, Any]:
-        return json.dumps(
+    def get_schema(self) -> str:
+        return self._schema
+
+    @cached_property
+    def _schema(self) -> str:
+        return json_dumps(
             {
                 "name": self.name,
                 "description": self.description,
                 "args": [arg for arg in self.args],
             },
-            indent=2,
-            ensure_ascii=False,
+            indent=True,
         )
 
 
+def _map_concurrently(function: Callable[..., Any], *iterables: list[Any]) -> list[Any]:
+    """Map an I/O-bound function over the arguments in a thread pool, keeping order."""
+    workers = min(_MAX_BULK_WORKERS, len(iterables[0])) if iterables else 0
+    if workers <= 1:
+        return list(map(function, *iterables))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(function, *iterables))
+
+
 def get_current_date() -> str:
     """Returns the current date in the format YYYY-MM-DD."""
     return datetime.date.today().isoformat()
@@ -43,7 +67,7 @@ def fetch_webpage(url: str) -> str:
     """Fetch the content of a webpage
     :param url: URL of the webpage to fetch
     """
-    response = requests.get(url)
+    response = _session.get(url)
     if response.status_code == 200:
         return response.text
     else:
@@ -103,7 +127,7 @@ def read_file_contents_bulk(target_paths: list[str]) -> list[str]:
     :param target_paths: List of target file paths to read from
     :return: List of file contents as strings
     """
-    return [read_file_contents(path) for path in target_paths]
+    return _map_concurrently(read_file_contents, target_paths)
 
 
 def write_file_contents(target_path: str, contents: str) -> str:
@@ -131,11 +155,7 @@ def create_file_bulk(target_paths: list[str]) -> list[str]:
     """Create multiple files at the specified paths
     :param target_paths: List of target file paths to create
     """
-    results: list[str] = []
-    for path in target_paths:
-        result = create_file(path)
-        results.append(result)
-    return results
+    return _map_concurrently(create_file, target_paths)
 
 
 def delete_file(target_path: str) -> str:
@@ -150,11 +170,7 @@ def delete_files_bulk(target_paths: list[str]) -> list[str]:
     """Delete multiple files at the specified paths
     :param target_paths: List of target file paths to delete
     """
-    results: list[str] = []
-    for path in target_paths:
-        result = delete_file(path)
-        results.append(result)
-    return results
+    return _map_concurrently(delete_file, target_paths)
 
 
 def check_file_existence(target_path: str) -> bool:
@@ -164,11 +180,51 @@ def check_file_existence(target_path: str) -> bool:
     return os.path.exists(target_path)
 
 
-def check_file_existence_bulk(target_paths: list[str]) -> list[bool]:
+def _list_directory(parent: str, max_entries: int) -> Optional[set[str]]:
+    """Return normalized names of the non-symlink entries of a directory,
+    None if it can't be read or has more than 'max_entries' entries."""
+    names: set[str] = set()
+    try:
+        with os.scandir(parent or os.curdir) as entries:
+            for count, entry in enumerate(entries, 1):
+                if count > max_entries:
+                    return None
+                # A symlink's target may be missing, those names are stat'd instead
+                if not entry.is_symlink():
+                    names.add(os.path.normcase(entry.name))
+    except OSError:
+        return None
+    return names
+
+
+def check_file_existence_bulk(target_paths: list[str]) -> dict[str, bool]:
     """Check if multiple files exist at the specified paths
     :param target_paths: List of target file paths to check
     """
-    return {path: check_file_existence(path) for path in target_paths}
+    paths_by_parent: dict[str, list[str]] = {}
+    for path in target_paths:
+        paths_by_parent.setdefault(os.path.dirname(path), []).append(path)
+
+    exists: dict[str, bool] = {}
+    for parent, paths in paths_by_parent.items():
+        # One directory read answers every path sharing this parent. Directories
+        # with more than _LISTING_ENTRIES_PER_PATH (64) entries per checked path
+        # are not listed, their paths are stat'd one by one instead
+        listing = (
+            _list_directory(parent, len(paths) * _LISTING_ENTRIES_PER_PATH)
+            if len(paths) > 1
+            else None
+        )
+        for path in paths:
+            name = os.path.normcase(os.path.basename(path))
+            if listing is not None and name in listing:
+                exists[path] = True
+            else:
+                # Misses may differ only in case or Unicode form from an entry,
+                # symlinks may point nowhere: let the filesystem decide
+                exists[path] = check_file_existence(path)
+
+    return {path: exists[path] for path in target_paths}
 
 
 def create_folder(target_path: str) -> str:
@@ -233,12 +289,21 @@ def download_file(url: str, target_path: str) -> str:
     :param target_path: destination file path to download to
 
     :return: Download result"""
+    # Stream into a side file, the target only appears once the body is complete
+    partial_path = target_path + ".part"
     try:
-        response = requests.get(url)
-        with open(target_path, "wb") as file:
-            file.write(response.content)
+        with _session.get(url, stream=True) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            with open(partial_path, "wb") as file:
+                shutil.copyfileobj(response.raw, file, length=_DOWNLOAD_CHUNK_SIZE)
+        os.replace(partial_path, target_path)
         return f"Downloaded {url} successfully"
     except Exception as e:
+        try:
+            os.unlink(partial_path)
+        except OSError:
+            pass
         return f"Error while downloading {url}: {e}"
 
 
@@ -249,10 +314,8 @@ def download_file_bulk(urls: list[str], target_paths: list[str]) -> dict[str, st
     :param target_path: destination file paths to download to
 
     :return: Download result for each url"""
-    result: dict[str, str] = {}
-    for idx, url in enumerate(urls):
-        result[url] = download_file(url, target_paths[idx])
-    return result
+    results = _map_concurrently(download_file, urls, target_paths)
+    return dict(zip(urls, results))
 
 
 def search_files(query: str) -> list[dict[str, str]]:
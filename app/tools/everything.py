@@ -1,25 +1,52 @@
 import re
 import requests
+from requests.adapters import HTTPAdapter
 from pathlib import Path
 from dataclasses import dataclass
 from datetime import datetime
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 
 import asyncio
 import aiohttp
-from bs4 import BeautifulSoup, ResultSet, Tag
+from lxml import html as lxml_html
+from lxml.etree import XPath
+
+_ROWS_XPATH = XPath("//tr[starts-with(@class, 'trdata')]")
+_NAV_HREF_XPATH = XPath(
+    "((//span[contains(concat(' ', normalize-space(@class), ' '), ' nav ')])"
+    "[last()]//a)[1]/@href"
+)
+_SIZE_RE = re.compile(r"(\d+(?:\.\d+)?)([KMGT]?B)")
+_OFFSET_RE = re.compile(r"offset=(\d+)")
+_UNITS = {"B": 1, "KB": 1024, "MB": 1024**2, "GB": 1024**3, "TB": 1024**4}
+_MAX_CONCURRENT_PAGES = 16
+
+_session = requests.Session()
+_session.headers.update({"Accept-Encoding": "gzip"})
+_session.mount("http://", HTTPAdapter(pool_maxsize=_MAX_CONCURRENT_PAGES))
 
 
 def parse_size(size_str: str) -> int:
     """Преобразует строку размера в байты."""
     size_str = size_str.upper().replace(" ", "")
-    units = {"B": 1, "KB": 1024, "MB": 1024**2, "GB": 1024**3}
-    if match := re.match(r"(\d+(?:\.\d+)?)([KMGT]?B)", size_str):
+    if match := _SIZE_RE.match(size_str):
         value, unit = match.groups()
-        return int(float(value) * units[unit])
+        return int(float(value) * _UNITS[unit])
     return 0
 
 
-@dataclass(frozen=True)
+def parse_date(date_str: str) -> datetime:
+    """Преобразует дату вида "MM/DD/YYYY HH:MM AM" без datetime.strptime."""
+    date_part, time_part, meridiem = date_str.split()
+    month, day, year = date_part.split("/")
+    hour, minute = time_part.split(":")
+    hour = int(hour) % 12
+    if meridiem.upper() == "PM":
+        hour += 12
+    return datetime(int(year), int(month), int(day), hour, int(minute))
+
+
+@dataclass(frozen=True, slots=True)
 class SearchResult:
     path: Path
     is_folder: bool
@@ -47,30 +74,36 @@ async def fetch_page_async(
 def fetch_page_sync(query: str, offset: int) -> tuple[int, str]:
     """Синхронно запрашивает страницу поиска Everything."""
     url = f"http://localhost:5432/?search={query}&offset={offset}"
-    response = requests.get(url, headers={"Accept-Encoding": "gzip"})
+    response = _session.get(url)
     return offset, response.text
 
 
 def parse_page(html: str) -> tuple[list[SearchResult], int]:
     """Извлекает файлы, их тип и дату изменения из HTML."""
-    parser = BeautifulSoup(html, "html.parser")
-    results: list[SearchResult] = []
-
-    for tr in parser.select("tr[class^=trdata]"):
-        tds: ResultSet[Tag] = tr.find_all("td")
-        type_class = tds[0].get("class", [])
-        is_folder = "folder" in type_class
-        filename = tds[0].text
-        path = Path(tds[1].text, filename)
-        size = parse_size(tds[2].text.strip())
-        modified = datetime.strptime(tds[3].text.strip(), "%m/%d/%Y %I:%M %p")
-        results.append(SearchResult(path, is_folder, size, modified))
+    html = html.lstrip()
+    if html.startswith("<?xml") and (end := html.find("?>")) != -1:
+        # lxml не принимает str с объявлением кодировки, текст уже декодирован
+        html = html[end + 2 :]
+    if not html.strip():
+        return [], 0
+
+    doc = lxml_html.fromstring(html)
+    # Колонки строки: имя (с классом типа), папка, размер, дата изменения
+    rows = [tr.findall("td")[:4] for tr in _ROWS_XPATH(doc)]
+    results = [
+        SearchResult(
+            Path(path_td.text_content(), name_td.text_content()),
+            "folder" in name_td.get("class", "").split(),
+            parse_size(size_td.text_content().strip()),
+            parse_date(date_td.text_content().strip()),
+        )
+        for name_td, path_td, size_td, date_td in rows
+    ]
 
     max_offset = 0
-    if spans := parser.find_all("span", {"class": "nav"}):
-        if a := spans[-1].find("a"):
-            if match := re.search(r"offset=(\d+)", a.get("href")):
-                max_offset = int(match.group(1))
+    if hrefs := _NAV_HREF_XPATH(doc):
+        if match := _OFFSET_RE.search(hrefs[0]):
+            max_offset = int(match.group(1))
 
     return results, max_offset
 
@@ -81,7 +114,10 @@ async def search_files_async(query: str) -> list[SearchResult]:
     seen_offsets: set[int] = set()
     tasks: dict[int, asyncio.Task[tuple[int, str]]] = {}
 
-    async with aiohttp.ClientSession() as session:
+    connector = aiohttp.TCPConnector(
+        limit=_MAX_CONCURRENT_PAGES, limit_per_host=_MAX_CONCURRENT_PAGES
+    )
+    async with aiohttp.ClientSession(connector=connector) as session:
         tasks[0] = asyncio.create_task(fetch_page_async(session, query, 0))
 
         while tasks:
@@ -113,24 +149,27 @@ async def search_files_async(query: str) -> list[SearchResult]:
 
 
 def search_files(query: str) -> list[SearchResult]:
-    """Синхронно ищет файлы во всех страницах Everything."""
+    """Синхронно ищет файлы во всех страницах Everything, загружая страницы параллельно."""
     files_by_offset: dict[int, list[SearchResult]] = {}
-    seen_offsets: set[int] = set()
-    offsets_to_fetch = [0]
+    seen_offsets: set[int] = {0}
 
-    while offsets_to_fetch:
-        offset = offsets_to_fetch.pop(0)
-        if offset in seen_offsets:
-            continue
+    with ThreadPoolExecutor(max_workers=_MAX_CONCURRENT_PAGES) as executor:
+        pending: set[Future[tuple[int, str]]] = {
+            executor.submit(fetch_page_sync, query, 0)
+        }
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
 
-        seen_offsets.add(offset)
-        _, html = fetch_page_sync(query, offset)
-        page_files, max_offset = parse_page(html)
-        files_by_offset[offset] = page_files
+            for future in done:
+                offset, html = future.result()
+                page_files, max_offset = parse_page(html)
+                files_by_offset[offset] = page_files
 
-        for new_offset in range(offset + 32, max_offset + 1, 32):
-            if new_offset not in seen_offsets:
-                offsets_to_fetch.append(new_offset)
+                for new_offset in range(offset + 32, max_offset + 1, 32):
+                    if new_offset not in seen_offsets:
+                        seen_offsets.add(new_offset)
+                        pending.add(executor.submit(fetch_page_sync, query, new_offset))
 
     return [
         file for offset in sorted(files_by_offset) for file in files_by_offset[offset]
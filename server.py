@@ -1,29 +1,71 @@
 import asyncio
-from asyncio import WindowsSelectorEventLoopPolicy
+import hashlib
+import logging
+import os
+import sys
+from typing import Any, AsyncIterator
 from fastapi import FastAPI
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
+from cachetools import TTLCache
 from g4f.client import AsyncClient
 from g4f.Provider import PollinationsAI, OIVSCode, DDG, RetryProvider
 
+from app import serialization
+
 
 class CompletionRequest(BaseModel):
     model: str
     messages: list[dict[str, str]]
     temperature: float = 0
+    stream: bool = False
 
 
 app = FastAPI()
+logger = logging.getLogger(__name__)
 
-asyncio.set_event_loop_policy(WindowsSelectorEventLoopPolicy())
+if sys.platform == "win32":
+    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 client = AsyncClient(provider=RetryProvider([PollinationsAI, OIVSCode, DDG]))
+# Exact-match cache of recent encoded completions, keyed by completion_cache_key()
+completion_cache: TTLCache[str, bytes] = TTLCache(maxsize=512, ttl=300)
 
 
-@app.post("/v1/chat/completions")
-async def create_chat_completion(request: CompletionRequest):
-    print(request)
-    response = await client.chat.completions.create(
-        messages=request.messages, model=request.model
-    )
+def completion_cache_key(request: CompletionRequest) -> str:
+    return hashlib.blake2b(
+        serialization.dumps_bytes(
+            [request.model, request.temperature, request.messages]
+        ),
+        digest_size=16,
+    ).hexdigest()
+
+
+async def stream_completion_events(response: AsyncIterator[Any]) -> AsyncIterator[str]:
+    """Re-emit g4f completion chunks as OpenAI-style server-sent events."""
+    async for chunk in response:
+        payload = {
+            "id": chunk.id,
+            "object": chunk.object,
+            "created": chunk.created,
+            "model": None,
+            "choices": [
+                {
+                    "index": choice.index,
+                    "delta": {
+                        "role": choice.delta.role,
+                        "content": choice.delta.content,
+                    },
+                    "finish_reason": choice.finish_reason,
+                }
+                for choice in chunk.choices
+            ],
+        }
+        yield f"data: {serialization.dumps(payload)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+def completion_payload(response: Any) -> dict[str, Any]:
+    """Convert a g4f ChatCompletion into an OpenAI-style response body."""
     return {
         "id": response.id,
         "object": response.object,
@@ -50,7 +92,44 @@ async def create_chat_completion(request: CompletionRequest):
     }
 
 
+@app.post("/v1/chat/completions")
+async def create_chat_completion(request: CompletionRequest):
+    logger.debug(
+        "completion request: model=%s messages=%d stream=%s",
+        request.model,
+        len(request.messages),
+        request.stream,
+    )
+    if request.stream:
+        response = client.chat.completions.create(
+            messages=request.messages, model=request.model, stream=True
+        )
+        return StreamingResponse(
+            stream_completion_events(response), media_type="text/event-stream"
+        )
+
+    cache_key = completion_cache_key(request)
+    if (body := completion_cache.get(cache_key)) is None:
+        response = await client.chat.completions.create(
+            messages=request.messages, model=request.model
+        )
+        body = serialization.dumps_bytes(completion_payload(response))
+        completion_cache[cache_key] = body
+
+    # Pre-encoded body, bypasses FastAPI's jsonable_encoder and stdlib json
+    return Response(content=body, media_type="application/json")
+
+
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=1337)
+    # uvicorn picks uvloop and httptools automatically where they are installed.
+    # completion_cache lives in each worker process, so more workers mean more misses
+    uvicorn.run(
+        "server:app",
+        app_dir=os.path.dirname(os.path.abspath(__file__)),
+        host="0.0.0.0",
+        port=1337,
+        workers=int(os.environ.get("SERVER_WORKERS", "1")),
+        log_level="warning",
+    )
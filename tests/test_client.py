@@ -0,0 +1,67 @@
+import pytest
+
+from app.protocol import XMLConversationProtocol
+from client import LLM
+
+
+def make_llm(limit: int, history_size: int, question_index: int) -> LLM:
+    llm = LLM("test-model", tools=[], max_history_messages=limit)
+    llm.history = [
+        {"role": "user" if i % 2 else "assistant", "content": f"message {i}"}
+        for i in range(history_size)
+    ]
+    llm._question_index = question_index
+    return llm
+
+
+def omitted_count(note: dict[str, str]) -> int:
+    thoughts = XMLConversationProtocol.parse(note["content"]).thoughts
+    return int(thoughts.split(" ", 1)[0])
+
+
+@pytest.mark.parametrize("history_size", [0, 1, 4, 5])
+def test_compact_history_keeps_history_within_limit(history_size: int) -> None:
+    llm = make_llm(limit=5, history_size=history_size, question_index=0)
+    assert llm._compact_history() == llm.history
+    llm.close()
+
+
+def test_compact_history_question_in_tail() -> None:
+    llm = make_llm(limit=5, history_size=10, question_index=7)
+    window = llm._compact_history()
+
+    assert len(window) == 5
+    assert omitted_count(window[0]) == 6
+    assert window[1:] == llm.history[6:]
+    llm.close()
+
+
+@pytest.mark.parametrize("limit", [3, 5, 8])
+def test_compact_history_question_before_tail(limit: int) -> None:
+    llm = make_llm(limit=limit, history_size=12, question_index=1)
+    window = llm._compact_history()
+
+    assert len(window) == limit
+    assert window[0] == llm.history[1]
+    # Everything except the question and the tail after the note is omitted
+    tail = window[2:]
+    assert tail == llm.history[len(llm.history) - len(tail) :]
+    assert omitted_count(window[1]) == len(llm.history) - 1 - len(tail)
+    llm.close()
+
+
+def test_compact_history_question_before_tail_by_hand() -> None:
+    llm = make_llm(limit=5, history_size=9, question_index=1)
+    window = llm._compact_history()
+
+    # Kept: question 1, the note, 6..8; omitted: 0 and 2..5
+    assert window[0] == llm.history[1]
+    assert omitted_count(window[1]) == 5
+    assert window[2:] == llm.history[6:]
+    llm.close()
+
+
+@pytest.mark.parametrize("limit", [0, 2])
+def test_too_small_history_limit_is_rejected(limit: int) -> None:
+    with pytest.raises(ValueError):
+        LLM("test-model", tools=[], max_history_messages=limit)
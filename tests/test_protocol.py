@@ -0,0 +1,63 @@
+import random
+import re
+
+import pytest
+
+from app.protocol import MESSAGE_TAGS, scan_tag_blocks
+
+_REGEXP_FLAGS = re.IGNORECASE | re.MULTILINE | re.DOTALL
+
+# One independent search per tag, as the XML protocol parsed messages with regexes
+TAG_EXPRS = {
+    tag: re.compile(rf"<{tag}>(.*?)</{tag}>", _REGEXP_FLAGS) for tag in MESSAGE_TAGS
+}
+
+
+def regex_tag_blocks(text: str) -> dict[str, str]:
+    blocks: dict[str, str] = {}
+    for tag, expr in TAG_EXPRS.items():
+        if match := expr.search(text):
+            blocks[tag] = match.group(1)
+    return blocks
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "",
+        "no tags at all",
+        "<thoughts>t</thoughts><tool>x</tool><tool_args>[1]</tool_args>",
+        "<THOUGHTS>t</Thoughts>\n<response>multi\nline</RESPONSE>",
+        "<response>see <thoughts>t</thoughts></response>",
+        "<thoughts>I'll call <tool>x</tool></thoughts>",
+        "<thoughts>a<thoughts>b</thoughts>c</thoughts>",
+        "<tool>unclosed <tool>x</tool>",
+        "<tool_args>[]</tool><tool>y</tool_args></tool>",
+        "<response>first</response><response>second</response>",
+        "<thoughtſ>long s</THOUGHTſ>",
+        "İ<thoughts>ß</thoughts><TOOL>ǅ</TOOL>",
+    ],
+)
+def test_scan_tag_blocks_matches_regex(text: str) -> None:
+    assert scan_tag_blocks(text) == regex_tag_blocks(text)
+
+
+def test_scan_tag_blocks_matches_regex_on_random_tag_soup() -> None:
+    rng = random.Random(0)
+    pieces = [
+        *(f"<{tag}>" for tag in MESSAGE_TAGS),
+        *(f"</{tag}>" for tag in MESSAGE_TAGS),
+        *(f"<{tag.upper()}>" for tag in MESSAGE_TAGS),
+        *(f"</{tag.title()}>" for tag in MESSAGE_TAGS),
+        "<",
+        ">",
+        "</",
+        "<tool_",
+        "text",
+        "\n",
+        "İ",
+        "ſ",
+    ]
+    for _ in range(20_000):
+        text = "".join(rng.choices(pieces, k=rng.randint(0, 16)))
+        assert scan_tag_blocks(text) == regex_tag_blocks(text), text
@@ -0,0 +1,38 @@
+import os
+
+import pytest
+
+import app.tools
+from app.tools import check_file_existence_bulk
+
+
+@pytest.fixture
+def target_paths(tmp_path, monkeypatch) -> list[str]:
+    (tmp_path / "file").write_text("")
+    (tmp_path / "d").mkdir()
+    (tmp_path / "broken").symlink_to(tmp_path / "nowhere")
+    (tmp_path / "valid").symlink_to(tmp_path / "file")
+    monkeypatch.chdir(tmp_path)
+
+    names = ["file", "missing", "broken", "valid", "d/", "..", "", "file/x", "d/.."]
+    return [
+        *(os.path.join(tmp_path, name) for name in names),
+        # Relative paths share the current directory as their parent
+        "file",
+        "missing",
+        "broken",
+    ]
+
+
+def test_check_file_existence_bulk_matches_os_path_exists(target_paths) -> None:
+    assert check_file_existence_bulk(target_paths) == {
+        path: os.path.exists(path) for path in target_paths
+    }
+
+
+def test_check_file_existence_bulk_without_listing(target_paths, monkeypatch) -> None:
+    # Every directory is too large to list, all paths are stat'd one by one
+    monkeypatch.setattr(app.tools, "_LISTING_ENTRIES_PER_PATH", 0)
+    assert check_file_existence_bulk(target_paths) == {
+        path: os.path.exists(path) for path in target_paths
+    }